@@ -4,13 +4,33 @@ Includes detailed logging, performance monitoring, and debug endpoints
 """
 
 from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from starlette.middleware.gzip import GZipMiddleware
 from pydantic import BaseModel
+import orjson
 from typing import List, Dict, Any
 import numpy as np
+import torch
 from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
+import asyncio
+import functools
 import logging
+import re
 import time
+
+from onnx_encoder import load_onnx_model
+
+# Optional SIMD-accelerated cosine kernels (AVX-512/NEON)
+try:
+    import simsimd
+except ImportError:
+    simsimd = None
+
+# Optional JIT compiler for the fused argmax kernel
+try:
+    import numba
+except ImportError:
+    numba = None
 import psutil
 import os
 from datetime import datetime
@@ -31,15 +51,197 @@ app = FastAPI(
     title="ETL Sidecar - Debug Mode",
     description="Semantic similarity service for Smart-ETL header mapping (DEBUG)",
     version="1.0.0-debug",
-    debug=True
+    debug=True,
+    default_response_class=ORJSONResponse
 )
 
+# Large similarity matrices are mostly near-zero floats and compress
+# 4-8x; responses under 1KB (healthz etc.) pass through untouched
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
 # Global variables for debugging
 model = None
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+# Local snapshot written on the first ever load so later starts skip the
+# HuggingFace Hub and mmap the weights from safetensors
+MODEL_DIR = os.environ.get("MODEL_DIR", os.path.join("./models", MODEL_NAME))
+
 request_count = 0
 total_processing_time = 0
 model_load_time = 0
 
+# Cache of (model name, normalized text) -> unit-norm embedding; keyed by
+# model name so a model swap can't serve stale vectors
+embedding_cache: Dict[Any, np.ndarray] = {}
+embedding_cache_lock = asyncio.Lock()
+
+def normalize_key(text):
+    """Collapse case/whitespace/separator variants onto one cache key"""
+    return re.sub(r'[\s_-]+', ' ', text.strip().casefold())
+
+async def encode_cached(texts):
+    """Encode texts, reusing cached embeddings for repeated strings"""
+    model = load_model()
+    if not texts:
+        return np.zeros((0, model.get_sentence_embedding_dimension()), dtype=np.float32)
+    async with embedding_cache_lock:
+        keys = [(MODEL_NAME, normalize_key(t)) for t in texts]
+        # Dedupe within the request too: "Customer_Name" and "customer name"
+        # share one key, so only the first variant of each gets encoded
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in embedding_cache and key not in missing:
+                missing[key] = text
+        logger.debug(f"💾 Embedding cache: {len(texts) - len(missing)}/{len(texts)} hits")
+        if missing:
+            # Sort by length so a single long text doesn't force every
+            # shorter one in its batch to pad up to it; the cache gather
+            # below restores the original order
+            to_encode = sorted(missing.items(), key=lambda item: len(item[1]))
+
+            def run_encode():
+                # inference_mode is strictly cheaper than encode's default
+                # no_grad: no version-counter bumps or view tracking
+                with torch.inference_mode():
+                    return model.encode([text for _, text in to_encode],
+                                        batch_size=64, show_progress_bar=False,
+                                        normalize_embeddings=True, convert_to_numpy=True)
+
+            # Run the blocking, CPU-heavy encode in the default executor so
+            # the event loop (and /healthz) stays responsive under load
+            new_embeddings = await asyncio.get_running_loop().run_in_executor(None, run_encode)
+            new_embeddings = new_embeddings.astype(np.float32, copy=False)
+            for (key, _), embedding in zip(to_encode, new_embeddings):
+                embedding_cache[key] = embedding
+        return np.stack([embedding_cache[key] for key in keys])
+
+# Micro-batching queue: concurrent requests are coalesced into a single
+# encode call so matmul throughput is realized at real batch sizes
+BATCH_MAX_SIZE = 64
+BATCH_MAX_WAIT = 0.005  # seconds
+encode_queue: asyncio.Queue = asyncio.Queue()
+batch_worker_task = None
+
+async def encode_batched(texts):
+    """Submit texts to the batching queue and await their embeddings"""
+    future = asyncio.get_running_loop().create_future()
+    await encode_queue.put((texts, future))
+    return await future
+
+async def batch_worker():
+    """Drain the encode queue, coalescing waiting requests into one encode"""
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await encode_queue.get()]
+        deadline = loop.time() + BATCH_MAX_WAIT
+        # Keep accumulating until the window closes or the batch is full
+        while sum(len(texts) for texts, _ in batch) < BATCH_MAX_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(encode_queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        flattened = [t for texts, _ in batch for t in texts]
+        logger.debug(f"📦 Micro-batch: {len(batch)} requests, {len(flattened)} texts")
+        try:
+            embeddings = await encode_cached(flattened)
+            # Slice the stacked embeddings back out per request
+            offset = 0
+            for texts, future in batch:
+                if not future.done():
+                    future.set_result(embeddings[offset:offset + len(texts)])
+                offset += len(texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+# Canonical-field lists are a nearly static taxonomy reused across every
+# request, so cache the stacked matrix per exact tuple on top of the
+# per-string cache
+canonical_cache: Dict[tuple, np.ndarray] = {}
+CANONICAL_CACHE_MAX = 128
+
+async def encode_canonical(fields):
+    """Embeddings for a canonical-field list, cached on the full tuple"""
+    key = (MODEL_NAME,) + tuple(fields)
+    cached = canonical_cache.get(key)
+    if cached is None:
+        logger.debug(f"💾 Canonical cache miss for {len(fields)} fields")
+        cached = await encode_batched(list(fields))
+        if len(canonical_cache) >= CANONICAL_CACHE_MAX:
+            # Drop the oldest entry (dicts preserve insertion order)
+            canonical_cache.pop(next(iter(canonical_cache)))
+        canonical_cache[key] = cached
+    return cached
+
+def quantize_int8(embeddings):
+    """Quantize unit-norm float embeddings to int8"""
+    return np.round(embeddings * 127).clip(-128, 127).astype(np.int8)
+
+def similarity_matrix(header_embeddings, canonical_embeddings):
+    """Cosine similarity matrix over unit-norm embeddings"""
+    if simsimd is not None:
+        # int8 dot products dispatch to VNNI at ~4x FP32 throughput, and
+        # cosine is scale-invariant so quantizing unit-norm vectors to the
+        # full int8 range is effectively lossless for ranking
+        q_headers = quantize_int8(header_embeddings)
+        q_canonical = quantize_int8(canonical_embeddings)
+        # Fused dot+norm SIMD kernel, one pass over the data; keep the
+        # scores float32 so nothing downstream silently upcasts to float64
+        distances = np.asarray(simsimd.cdist(q_headers, q_canonical, metric="cosine"),
+                               dtype=np.float32)
+        return 1.0 - distances
+    # Fallback: embeddings are unit-norm, so cosine is just a dot product
+    # (float32 SGEMM, ~2x DGEMM and half the bandwidth)
+    return (header_embeddings @ canonical_embeddings.T).astype(np.float32, copy=False)
+
+if numba is not None:
+    @numba.njit(parallel=True, fastmath=True, cache=True)
+    def _argmax_cosine(header_embeddings, canonical_embeddings):
+        # Fused dot + running max per header: never materializes the H x C
+        # matrix, and the 384-wide inner loop autovectorizes
+        n_headers = header_embeddings.shape[0]
+        best_idx = np.empty(n_headers, dtype=np.int64)
+        best_score = np.empty(n_headers, dtype=np.float32)
+        for i in numba.prange(n_headers):
+            best_j = 0
+            best_s = np.float32(-2.0)
+            for j in range(canonical_embeddings.shape[0]):
+                s = np.float32(0.0)
+                for k in range(header_embeddings.shape[1]):
+                    s += header_embeddings[i, k] * canonical_embeddings[j, k]
+                if s > best_s:
+                    best_s = s
+                    best_j = j
+            best_idx[i] = best_j
+            best_score[i] = best_s
+        return best_idx, best_score
+
+def best_matches(header_embeddings, canonical_embeddings):
+    """Best canonical index and score per header over unit-norm embeddings"""
+    if numba is not None:
+        return _argmax_cosine(header_embeddings, canonical_embeddings)
+    # Fallback: materialize the matrix and reduce with NumPy
+    similarities = similarity_matrix(header_embeddings, canonical_embeddings)
+    best_idx = similarities.argmax(axis=1)
+    return best_idx, similarities[np.arange(len(best_idx)), best_idx]
+
+def _load_sentence_transformer(device):
+    """Load the model from the local snapshot, creating it if needed"""
+    if os.path.isdir(MODEL_DIR):
+        logger.debug(f"📂 Loading model from local snapshot: {MODEL_DIR}")
+        return SentenceTransformer(MODEL_DIR, device=device)
+    model = SentenceTransformer(MODEL_NAME, device=device)
+    # save() writes model.safetensors + config, so the pickle-based
+    # pytorch_model.bin path is never touched again
+    logger.debug(f"📂 Saving model snapshot to {MODEL_DIR}")
+    model.save(MODEL_DIR)
+    return model
+
 def load_model():
     """Load the sentence transformer model with debug logging"""
     global model, model_load_time
@@ -48,8 +250,21 @@ def load_model():
         logger.debug("🔄 Loading sentence transformer model...")
         logger.debug(f"📊 Available memory: {psutil.virtual_memory().available / 1024**3:.2f} GB")
         
+        # This service never trains, so autograd is pure overhead
+        torch.set_grad_enabled(False)
+
         try:
-            model = SentenceTransformer('all-MiniLM-L6-v2')
+            if torch.cuda.is_available():
+                # GPU inference beats any of the CPU backends by a wide margin
+                logger.debug(f"🖥️  CUDA available: {torch.cuda.get_device_name(0)}")
+                model = _load_sentence_transformer("cuda")
+            else:
+                # Prefer the graph-optimized ONNX Runtime backend when available
+                model = load_onnx_model(MODEL_NAME)
+                if model is None:
+                    # Leave half the cores for the executor threads driving encode
+                    torch.set_num_threads(max(1, os.cpu_count() // 2))
+                    model = _load_sentence_transformer("cpu")
             model_load_time = time.time() - start_time
             logger.info(f"✅ Model loaded successfully in {model_load_time:.2f} seconds")
             logger.debug(f"📊 Model memory usage: {psutil.virtual_memory().used / 1024**3:.2f} GB")
@@ -58,6 +273,36 @@ def load_model():
             raise
     return model
 
+@functools.lru_cache(maxsize=1)
+def _sample_system_stats(ttl_bucket):
+    """Sample psutil once per TTL window; ttl_bucket keys the cache"""
+    memory_info = psutil.virtual_memory()
+    return {
+        "memory_usage": {
+            "total": memory_info.total / 1024**3,
+            "available": memory_info.available / 1024**3,
+            "used": memory_info.used / 1024**3,
+            "percent": memory_info.percent
+        },
+        "cpu_percent": psutil.cpu_percent()
+    }
+
+def system_stats():
+    """System stats with a 5s TTL so healthz probes don't re-parse /proc"""
+    return _sample_system_stats(int(time.time() // 5))
+
+@app.on_event("startup")
+async def warm_model():
+    """Load and warm the model before the first request arrives"""
+    global batch_worker_task
+    batch_worker_task = asyncio.create_task(batch_worker())
+    start_time = time.time()
+    model = load_model()
+    # Dummy encode exercises tokenizer and kernel-selection paths up front
+    # so the first real request doesn't pay for them
+    model.encode(["warmup"], normalize_embeddings=True, convert_to_numpy=True)
+    logger.info(f"🔥 Model warmed up in {time.time() - start_time:.2f}s")
+
 @app.middleware("http")
 async def debug_middleware(request: Request, call_next):
     """Debug middleware for request/response logging"""
@@ -85,27 +330,21 @@ async def health_check():
     try:
         start_time = time.time()
         model = load_model()
-        
-        # System information
-        memory_info = psutil.virtual_memory()
-        cpu_percent = psutil.cpu_percent()
-        
+
+        # System information, TTL-cached so frequent probes stay cheap
+        stats = system_stats()
+
         health_data = {
             "status": "ok",
-            "model": "all-MiniLM-L6-v2",
+            "model": MODEL_NAME,
             "service": "etl-sidecar-debug",
             "debug_info": {
                 "model_load_time": model_load_time,
                 "request_count": request_count,
                 "total_processing_time": total_processing_time,
                 "average_request_time": total_processing_time / max(request_count, 1),
-                "memory_usage": {
-                    "total": memory_info.total / 1024**3,
-                    "available": memory_info.available / 1024**3,
-                    "used": memory_info.used / 1024**3,
-                    "percent": memory_info.percent
-                },
-                "cpu_percent": cpu_percent,
+                "memory_usage": stats["memory_usage"],
+                "cpu_percent": stats["cpu_percent"],
                 "uptime": time.time() - os.path.getctime(__file__)
             }
         }
@@ -121,58 +360,59 @@ class SimilarityRequest(BaseModel):
     headers: List[str]
     canonicalFields: List[str]
 
-class SimilarityResponse(BaseModel):
-    model: str
-    similarities: List[List[float]]
-    debug_info: Dict[str, Any] = {}
-
-@app.post("/similarity/headers", response_model=SimilarityResponse)
+@app.post("/similarity/headers")
 async def calculate_similarities(request: SimilarityRequest):
     """Calculate semantic similarities with debug information"""
+    # Nothing to compare: answer without touching the model at all
+    if not request.headers or not request.canonicalFields:
+        logger.debug("⏭️  Empty request, skipping similarity calculation")
+        return ORJSONResponse({
+            "model": MODEL_NAME,
+            "similarities": [[] for _ in request.headers],
+            "debug_info": {}
+        })
+
+    # Bound the response matrix so one request can't blow up memory
+    if len(request.headers) * len(request.canonicalFields) > 1_000_000:
+        raise HTTPException(status_code=413, detail="Similarity matrix too large")
+
     try:
         start_time = time.time()
         
         # Load model
         model = load_model()
         
-        logger.debug(f"🔍 Processing similarity request:")
-        logger.debug(f"📋 Headers: {request.headers}")
-        logger.debug(f"📋 Canonical Fields: {request.canonicalFields}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("🔍 Processing similarity request:")
+            logger.debug("📋 Headers: %s", request.headers)
+            logger.debug("📋 Canonical Fields: %s", request.canonicalFields)
         
-        # Combine all texts for batch processing
-        all_texts = request.headers + request.canonicalFields
-        logger.debug(f"📊 Total texts to process: {len(all_texts)}")
-        
-        # Get embeddings for all texts
+        # Get unit-norm embeddings via the batching queue; the canonical
+        # side usually comes straight from its tuple-level cache
         embedding_start = time.time()
-        embeddings = model.encode(all_texts)
+        header_embeddings, canonical_embeddings = await asyncio.gather(
+            encode_batched(request.headers),
+            encode_canonical(request.canonicalFields)
+        )
         embedding_time = time.time() - embedding_start
-        
+
         logger.debug(f"🧠 Embedding generation took {embedding_time:.3f}s")
-        logger.debug(f"📊 Embedding shape: {embeddings.shape}")
-        
-        # Split embeddings back to headers and canonical fields
-        header_embeddings = embeddings[:len(request.headers)]
-        canonical_embeddings = embeddings[len(request.headers):]
+        logger.debug(f"📊 Embedding shapes: {header_embeddings.shape} x {canonical_embeddings.shape}")
         
         # Calculate similarity matrix
         similarity_start = time.time()
-        similarities = cosine_similarity(header_embeddings, canonical_embeddings)
+        similarities = similarity_matrix(header_embeddings, canonical_embeddings)
         similarity_time = time.time() - similarity_start
         
         logger.debug(f"📐 Similarity calculation took {similarity_time:.3f}s")
         logger.debug(f"📊 Similarity matrix shape: {similarities.shape}")
         
-        # Convert to list of lists for JSON serialization
-        similarities_list = similarities.tolist()
-        
-        # Log similarity matrix for debugging
-        logger.debug("📊 Similarity Matrix:")
-        for i, header in enumerate(request.headers):
-            for j, canonical in enumerate(request.canonicalFields):
-                score = similarities_list[i][j]
-                logger.debug(f"  {header} → {canonical}: {score:.3f}")
-        
+        # Log the whole matrix in one call: NumPy formats it in C, and the
+        # isEnabledFor guard skips even that when DEBUG is filtered out.
+        # The old per-element loop built H*C f-strings on every request.
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("📊 Similarity Matrix:\n%s", np.array2string(similarities, precision=3))
+
         total_time = time.time() - start_time
         
         debug_info = {
@@ -186,18 +426,56 @@ async def calculate_similarities(request: SimilarityRequest):
         }
         
         logger.info(f"✅ Similarity calculation completed in {total_time:.3f}s")
-        
-        return SimilarityResponse(
-            model="all-MiniLM-L6-v2",
-            similarities=similarities_list,
-            debug_info=debug_info
-        )
+
+        # orjson serializes the numpy matrix directly in C; a .tolist() plus
+        # Pydantic round-trip would allocate a Python object per float
+        return ORJSONResponse({
+            "model": MODEL_NAME,
+            "similarities": similarities,
+            "debug_info": debug_info
+        })
         
     except Exception as e:
         logger.error(f"❌ Error calculating similarities: {e}")
         logger.error(f"📊 Error details: {str(e)}")
         raise HTTPException(status_code=500, detail=f"Error calculating similarities: {str(e)}")
 
+@app.post("/similarity/headers/best")
+async def calculate_best_matches(request: SimilarityRequest):
+    """Return only the best canonical field per header, with debug timing"""
+    if not request.headers or not request.canonicalFields:
+        return ORJSONResponse({
+            "model": MODEL_NAME,
+            "matches": []
+        })
+
+    try:
+        start_time = time.time()
+        load_model()
+
+        header_embeddings, canonical_embeddings = await asyncio.gather(
+            encode_batched(request.headers),
+            encode_canonical(request.canonicalFields)
+        )
+
+        match_start = time.time()
+        best_idx, best_score = best_matches(header_embeddings, canonical_embeddings)
+        logger.debug(f"📐 Best-match kernel took {time.time() - match_start:.3f}s "
+                     f"(numba={'on' if numba is not None else 'off'})")
+
+        return ORJSONResponse({
+            "model": MODEL_NAME,
+            "matches": [
+                {"header": header, "match": request.canonicalFields[j], "score": float(score)}
+                for header, j, score in zip(request.headers, best_idx, best_score)
+            ],
+            "debug_info": {"processing_time": time.time() - start_time}
+        })
+
+    except Exception as e:
+        logger.error(f"❌ Error calculating best matches: {e}")
+        raise HTTPException(status_code=500, detail=f"Error calculating best matches: {str(e)}")
+
 @app.get("/debug/stats")
 async def debug_stats():
     """Debug statistics endpoint"""
@@ -232,11 +510,11 @@ async def debug_test():
     # Simulate similarity calculation
     request = SimilarityRequest(headers=test_headers, canonicalFields=test_canonical)
     response = await calculate_similarities(request)
-    
+
     return {
         "test": "debug_test",
         "status": "success",
-        "result": response
+        "result": orjson.loads(response.body)
     }
 
 @app.get("/")
@@ -248,6 +526,7 @@ async def root():
         "endpoints": {
             "health": "/healthz",
             "similarity": "/similarity/headers",
+            "similarity_best": "/similarity/headers/best",
             "debug_stats": "/debug/stats",
             "debug_test": "/debug/test",
             "docs": "/docs"
@@ -257,5 +536,8 @@ async def root():
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=3009, log_level="debug", reload=True)
+    # uvloop + httptools come with uvicorn[standard]; keep reload here
+    # since this entry point is debug-only
+    uvicorn.run("debug_app:app", host="0.0.0.0", port=3009, log_level="debug",
+                loop="uvloop", http="httptools", reload=True)
 
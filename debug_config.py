@@ -4,6 +4,7 @@ Enhanced logging and debugging settings
 """
 
 import logging
+import os
 import sys
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
@@ -42,20 +43,31 @@ def create_debug_app():
     
     return app
 
-def run_debug_server():
+def run_debug_server(reload=False):
     """Run the debug server with enhanced settings"""
+    # Auto-reload adds filesystem-watch overhead and forces a single
+    # worker, so it stays behind the --reload flag
     uvicorn.run(
         "app:app",
         host="0.0.0.0",
         port=3009,
-        reload=True,
+        reload=reload,
         log_level="debug",
         access_log=True,
-        debug=True,
-        reload_dirs=["./"],
+        loop="uvloop",
+        http="httptools",
+        workers=1 if reload else os.cpu_count(),
+        reload_dirs=["./"] if reload else None,
         reload_delay=1.0
     )
 
 if __name__ == "__main__":
-    run_debug_server()
+    import argparse
+
+    parser = argparse.ArgumentParser(description="ETL Sidecar debug server")
+    parser.add_argument("--reload", action="store_true",
+                        help="Enable auto-reload (development only)")
+    args = parser.parse_args()
+
+    run_debug_server(reload=args.reload)
 